@@ -1,48 +1,194 @@
-from typing import Annotated, Dict, TypedDict, List
-from langgraph.graph import Graph
+from functools import lru_cache
+from typing import Annotated, Any, Dict, List, Optional, Set
 from langchain_openai import ChatOpenAI
 from langchain_anthropic import ChatAnthropic
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema import BaseMessage
-import json
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from cache import get_cache
+import asyncio
+import httpx
+import logging
+import msgspec
 import re
 
-class AgentState(TypedDict):
-    messages: List[BaseMessage]
-    article: str
-    topic: str
-    openai_analysis: Dict
-    anthropic_analysis: Dict
-    final_comparison: Dict
+logger = logging.getLogger(__name__)
+
+OPENAI_MODEL = "gpt-4o-mini"
+ANTHROPIC_MODEL = "claude-3-5-sonnet-latest"
+# Smaller model used to merge analyses that already agree
+MERGE_MODEL = "gpt-4.1-nano"
+
+# (section, field) pairs of the rubric that carry an Excellent/Good/Fair/Poor rating
+_RATED_FIELDS = (
+    ("contentQuality", "depth"),
+    ("contentQuality", "accuracy"),
+    ("contentQuality", "originality"),
+    ("writingStyle", "clarity"),
+    ("writingStyle", "engagement"),
+    ("writingStyle", "flow")
+)
+_AGREEMENT_THRESHOLD = 0.8
+
+_CODEFENCE_RE = re.compile(rb"```(?:json)?\n(.*?)\n```", re.DOTALL)
+# Characters that affect JSON nesting depth, including the string delimiters and escapes that hide braces
+_JSON_STRUCTURE_RE = re.compile(r'[{}"\\]')
+
+class ObjectEndDetector:
+    """Finds where a streamed response's leading top-level JSON object closes.
+
+    Responses that don't start with '{' (e.g. fenced JSON) are never reported as closed
+    and have to be read to the end.
+    """
+
+    def __init__(self):
+        self._is_object = None
+        self._depth = 0
+        self._in_string = False
+        # Characters at the start of the next chunk hidden by an escape at the end of this one
+        self._skip = 0
+
+    def feed(self, text: str) -> int:
+        """Return the offset in text just past the object's closing brace, or -1 if it hasn't closed."""
+        if self._is_object is None:
+            stripped = text.lstrip()
+            if not stripped:
+                return -1
+            self._is_object = stripped[0] == "{"
+        if not self._is_object:
+            return -1
+
+        pos, self._skip = self._skip, 0
+        for match in _JSON_STRUCTURE_RE.finditer(text, pos):
+            i = match.start()
+            if i < pos:
+                continue
+            char = match.group()
+            if self._in_string:
+                if char == "\\":
+                    pos = i + 2
+                    self._skip = max(pos - len(text), 0)
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    return i + 1
+        return -1
+
+# Projections of an analysis onto what the comparison prompt draws on: each rated aspect
+# keeps its rating and its one short assessment, dropping lists like missingElements/uniqueElements
+class _Rated(msgspec.Struct, omit_defaults=True):
+    rating: Any = None
+
+class _DepthSummary(_Rated, omit_defaults=True):
+    analysis: Any = None
+
+class _AccuracySummary(_Rated, omit_defaults=True):
+    logicalIssues: Any = None
+
+class _IssuesSummary(_Rated, omit_defaults=True):
+    issues: Any = None
+
+class _EngagementSummary(_Rated, omit_defaults=True):
+    weaknesses: Any = None
+
+class _ContentQualitySummary(msgspec.Struct, omit_defaults=True):
+    depth: Optional[_DepthSummary] = None
+    accuracy: Optional[_AccuracySummary] = None
+    originality: Optional[_Rated] = None
+
+class _WritingStyleSummary(msgspec.Struct, omit_defaults=True):
+    clarity: Optional[_IssuesSummary] = None
+    engagement: Optional[_EngagementSummary] = None
+    flow: Optional[_IssuesSummary] = None
+
+class _SearchRankingSummary(msgspec.Struct, omit_defaults=True):
+    relevanceScore: Any = None
+    currentRankingPrediction: Any = None
+    competitorAnalysis: Any = None
+    rankingImprovement: Any = None
+    keywordGaps: Any = None
+
+class _QualitySummary(msgspec.Struct, omit_defaults=True):
+    score: Any = None
+    strengths: Any = None
+    immediateImprovements: Any = None
+
+class ComparatorInput(msgspec.Struct):
+    """The parts of an analysis the comparison prompt actually draws on."""
+    contentQuality: _ContentQualitySummary
+    writingStyle: _WritingStyleSummary
+    searchRankingAnalysis: _SearchRankingSummary
+    improvementActions: List[Any]
+    qualityAssessment: _QualitySummary
+
+def comparator_json(analysis: Dict) -> str:
+    """Serialize only the ComparatorInput fields; analyses that don't follow the rubric are passed whole."""
+    try:
+        analysis = msgspec.convert(analysis, ComparatorInput)
+    except msgspec.ValidationError:
+        pass
+    return msgspec.json.encode(analysis).decode()
 
 def extract_json_from_response(response_text: str) -> Dict:
     """Extract JSON from response that might be wrapped in markdown code blocks."""
-    # Try to extract JSON from code blocks first
-    json_match = re.search(r"```(?:json)?\n(.*?)\n```", response_text, re.DOTALL)
-    if json_match:
-        try:
-            return json.loads(json_match.group(1))
-        except:
-            pass
+    data = response_text.strip().encode()
+    if data[:1] == b"{":
+        # The prompts ask for a bare JSON object, so most responses decode without touching the regex
+        json_data = data
+    else:
+        # Otherwise try to extract JSON from a code block
+        json_match = _CODEFENCE_RE.search(data)
+        json_data = json_match.group(1) if json_match else None
     
-    # If no code block or parsing failed, try parsing the whole response
-    try:
-        return json.loads(response_text)
-    except:
-        return {
-            "error": "Failed to parse response",
-            "raw_response": response_text
-        }
-
-def create_analysis_prompt(article: str, topic: str = None) -> str:
-    topic_context = topic if topic else "the main theme suggested by this content"
+    if json_data is not None:
+        try:
+            result = msgspec.json.decode(json_data)
+        except msgspec.DecodeError:
+            result = None
+        # Callers index into the result, so anything but an object (a list, a bare scalar) is a parse failure
+        if isinstance(result, dict):
+            return result
     
-    return f"""Analyze the following article and provide detailed, actionable feedback:
+    return {
+        "error": "Failed to parse response",
+        "raw_response": response_text
+    }
 
-Article:
-{article}
+_http_client: httpx.AsyncClient = None
 
-Target Topic/Search Term: {topic_context}
+def use_http_client(client: httpx.AsyncClient = None) -> None:
+    """Send provider requests through client (None restores the SDK defaults); call before serving requests."""
+    global _http_client
+    _http_client = client
+    get_openai_llm.cache_clear()
+    get_merge_llm.cache_clear()
+
+def get_http_client() -> httpx.AsyncClient:
+    return _http_client
+
+@lru_cache(maxsize=None)
+def get_openai_llm() -> ChatOpenAI:
+    """Shared client so requests reuse its HTTP connection pool; created on first use, not at import."""
+    return ChatOpenAI(model=OPENAI_MODEL, temperature=0, http_async_client=_http_client)
+
+@lru_cache(maxsize=None)
+def get_anthropic_llm() -> ChatAnthropic:
+    # ChatAnthropic has no hook for a custom httpx client, but it already shares one cached client per base URL
+    return ChatAnthropic(model=ANTHROPIC_MODEL, temperature=0)
+
+@lru_cache(maxsize=None)
+def get_merge_llm() -> ChatOpenAI:
+    return ChatOpenAI(model=MERGE_MODEL, temperature=0, http_async_client=_http_client)
+
+def cacheable_system_message(text: str) -> SystemMessage:
+    """System message marked as a cacheable prefix for Anthropic prompt caching."""
+    return SystemMessage(content=[{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}])
+
+ANALYSIS_RUBRIC = """Analyze the article provided by the user for the given target topic/search term and provide detailed, actionable feedback.
 
 Please provide a structured analysis covering:
 
@@ -97,33 +243,7 @@ Please provide a structured analysis covering:
 
 Format your response as a JSON object with these exact keys. Do not wrap the JSON in code blocks. Be specific and actionable in your suggestions, especially for search ranking improvements."""
 
-def analyze_with_openai(state: AgentState) -> AgentState:
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-    prompt = ChatPromptTemplate.from_template(create_analysis_prompt(state["article"], state.get("topic")))
-    response = llm.invoke(prompt.format_messages())
-    state["openai_analysis"] = extract_json_from_response(response.content)
-    return state
-
-def analyze_with_anthropic(state: AgentState) -> AgentState:
-    llm = ChatAnthropic(model="claude-3-5-sonnet-latest", temperature=0)
-    prompt = ChatPromptTemplate.from_template(create_analysis_prompt(state["article"], state.get("topic")))
-    response = llm.invoke(prompt.format_messages())
-    state["anthropic_analysis"] = extract_json_from_response(response.content)
-    return state
-
-def compare_and_summarize(state: AgentState) -> AgentState:
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-    
-    comparison_prompt = ChatPromptTemplate.from_template(
-        """Compare the following two analyses of an article and provide a comprehensive improvement plan:
-
-OpenAI Analysis:
-{openai_analysis}
-
-Anthropic Analysis:
-{anthropic_analysis}
-
-Target Topic: {topic}
+COMPARISON_RUBRIC = """Compare the two analyses of an article provided by the user and provide a comprehensive improvement plan.
 
 Please provide:
 
@@ -159,36 +279,164 @@ Please provide:
    - expectedTimeToRank: How long might improvements take to show results?
 
 Format your response as a JSON object. Do not wrap the JSON in code blocks. Focus on specific, actionable improvements that will help with both content quality and search ranking."""
+
+MERGE_RUBRIC = """The two analyses of an article provided by the user largely agree. Merge them into a single improvement plan.
+
+Return a JSON object with these keys:
+- keyInsights: agreement, disagreement, mostActionableFeedback
+- searchRankingStrategy: currentPosition, topCompetitors, quickWins (3 items), longTermStrategy, contentGaps
+- prioritizedImprovementPlan: immediateActions, secondaryImprovements, optionalEnhancements
+- contentPositioning: bestAspectsToPreserve, criticalAreasToRevise, uniqueAngle, targetAudience
+- finalAssessment: combinedQualityScore, combinedRankingPrediction, confidenceLevel, expectedTimeToRank
+
+Do not wrap the JSON in code blocks. Keep every item specific and actionable."""
+
+# The system messages never change, so they are built once and shared by every request
+_ANALYSIS_SYSTEM_MESSAGE = SystemMessage(content=ANALYSIS_RUBRIC)
+_CACHED_ANALYSIS_SYSTEM_MESSAGE = cacheable_system_message(ANALYSIS_RUBRIC)
+_COMPARISON_SYSTEM_MESSAGE = SystemMessage(content=COMPARISON_RUBRIC)
+_MERGE_SYSTEM_MESSAGE = SystemMessage(content=MERGE_RUBRIC)
+
+def create_analysis_prompt(article: str, topic: str = None, cache_control: bool = False) -> List[BaseMessage]:
+    """Analysis messages with the static rubric in the system message and only the article/topic in the user turn.
+
+    This only prepares for provider prompt caching: the rubric (~550 tokens) is below the
+    1024-token minimum cacheable prefix for both OpenAI and Anthropic, so nothing is cached
+    and the cache_control marker has no effect until the rubric grows past that.
+    """
+    return [
+        _CACHED_ANALYSIS_SYSTEM_MESSAGE if cache_control else _ANALYSIS_SYSTEM_MESSAGE,
+        HumanMessage(content=analysis_user_content(article, topic))
+    ]
+
+def analysis_user_content(article: str, topic: str = None) -> str:
+    topic_context = topic if topic else "the main theme suggested by this content"
+    return f"Article:\n{article}\n\nTarget Topic/Search Term: {topic_context}"
+
+async def cache_lookup(cache_name: str, article: str, topic: str = None) -> Optional[Dict]:
+    """Cached result for the article, or None; cache failures (e.g. a rate-limited embedding call) count as a miss."""
+    try:
+        return await get_cache().get(cache_name, article, topic)
+    except Exception:
+        logger.warning("Semantic cache lookup failed; treating as a miss", exc_info=True)
+        return None
+
+async def cache_store(cache_name: str, article: str, topic: str, result: Dict) -> None:
+    """Store a result in the cache; a failure here must not discard a result that was already paid for."""
+    try:
+        await get_cache().put(cache_name, article, topic, result)
+    except Exception:
+        logger.warning("Semantic cache store failed; result not cached", exc_info=True)
+
+# Streams still being read after their result was returned; referenced here so they aren't garbage collected
+_DRAINING: Set[asyncio.Task] = set()
+
+async def _drain(stream) -> None:
+    try:
+        async for _ in stream:
+            pass
+    except Exception:
+        logger.debug("Failed to read the rest of a finished response stream", exc_info=True)
+
+def _drain_in_background(stream) -> None:
+    """Read the rest of stream without holding up the caller.
+
+    Closing an HTTP/1.1 response before its body is read makes httpx drop the pooled
+    connection, and the final events carry the output-token usage callbacks report.
+    """
+    task = asyncio.ensure_future(_drain(stream))
+    _DRAINING.add(task)
+    task.add_done_callback(_DRAINING.discard)
+
+async def cached_invoke(
+    llm,
+    cache_name: str,
+    messages: List[BaseMessage],
+    article: str,
+    topic: str = None,
+    use_cache: bool = True
+) -> Dict:
+    """Invoke llm unless an identical or near-identical article already has a result under cache_name."""
+    if use_cache:
+        result = await cache_lookup(cache_name, article, topic)
+        if result is not None:
+            return result
+
+    # Parse as soon as the JSON object closes instead of waiting for trailing text and the end of the stream
+    detector = ObjectEndDetector()
+    chunks = []
+    stream = llm.astream(messages)
+    draining = False
+    try:
+        async for chunk in stream:
+            end = detector.feed(chunk.content)
+            if end >= 0:
+                chunks.append(chunk.content[:end])
+                _drain_in_background(stream)
+                draining = True
+                break
+            chunks.append(chunk.content)
+    finally:
+        if not draining:
+            await stream.aclose()
+    result = extract_json_from_response("".join(chunks))
+    if use_cache and "error" not in result:
+        await cache_store(cache_name, article, topic, result)
+    return result
+
+async def analyze_with_openai(article: str, topic: str = None) -> Dict:
+    return await cached_invoke(
+        get_openai_llm(),
+        OPENAI_MODEL,
+        create_analysis_prompt(article, topic),
+        article,
+        topic
     )
-    
-    response = llm.invoke(
-        comparison_prompt.format_messages(
-            openai_analysis=json.dumps(state["openai_analysis"], indent=2),
-            anthropic_analysis=json.dumps(state["anthropic_analysis"], indent=2),
-            topic=state.get("topic", "the main theme")
-        )
+
+async def analyze_with_anthropic(article: str, topic: str = None) -> Dict:
+    return await cached_invoke(
+        get_anthropic_llm(),
+        ANTHROPIC_MODEL,
+        create_analysis_prompt(article, topic, cache_control=True),
+        article,
+        topic
     )
-    
-    state["final_comparison"] = extract_json_from_response(response.content)
-    return state
 
-def create_analysis_graph() -> Graph:
-    workflow = Graph()
-    
-    # Define the nodes
-    workflow.add_node("openai_analysis", analyze_with_openai)
-    workflow.add_node("anthropic_analysis", analyze_with_anthropic)
-    workflow.add_node("compare", compare_and_summarize)
-    
-    # Define the edges
-    workflow.add_edge("openai_analysis", "anthropic_analysis")
-    workflow.add_edge("anthropic_analysis", "compare")
-    
-    # Set the entry point
-    workflow.set_entry_point("openai_analysis")
+def _rating(analysis: Dict, section: str, field: str) -> str:
+    value = analysis.get(section)
+    value = value.get(field) if isinstance(value, dict) else None
+    rating = value.get("rating") if isinstance(value, dict) else None
+    return rating.strip().lower() if isinstance(rating, str) else None
+
+def rating_agreement(openai_analysis: Dict, anthropic_analysis: Dict) -> float:
+    """Fraction of rubric ratings on which both analyses agree; missing ratings count as disagreement."""
+    matches = 0
+    for section, field in _RATED_FIELDS:
+        rating = _rating(openai_analysis, section, field)
+        if rating is not None and rating == _rating(anthropic_analysis, section, field):
+            matches += 1
+    return matches / len(_RATED_FIELDS)
+
+async def compare_and_summarize(openai_analysis: Dict, anthropic_analysis: Dict, article: str, topic: str = None) -> Dict:
+    # Analyses that mostly agree only need merging, which the smaller model handles with a shorter prompt
+    if rating_agreement(openai_analysis, anthropic_analysis) >= _AGREEMENT_THRESHOLD:
+        llm, model_name, system_message = get_merge_llm(), MERGE_MODEL, _MERGE_SYSTEM_MESSAGE
+    else:
+        llm, model_name, system_message = get_openai_llm(), OPENAI_MODEL, _COMPARISON_SYSTEM_MESSAGE
     
-    # Set the exit point
-    workflow.set_finish_point("compare")
+    openai_json = comparator_json(openai_analysis)
+    anthropic_json = comparator_json(anthropic_analysis)
+    messages = [
+        system_message,
+        HumanMessage(content=f"OpenAI Analysis:\n{openai_json}\n\nAnthropic Analysis:\n{anthropic_json}\n\nTarget Topic: {topic or 'the main theme'}")
+    ]
     
-    # Compile the graph into a runnable chain
-    return workflow.compile() 
\ No newline at end of file
+    return await cached_invoke(
+        llm,
+        f"comparison:{model_name}",
+        messages,
+        article,
+        topic,
+        # The cache is keyed on the article alone, so only comparisons of two good analyses may be stored or reused
+        use_cache="error" not in openai_analysis and "error" not in anthropic_analysis
+    )
@@ -0,0 +1,234 @@
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, List, Tuple
+from anthropic import AsyncAnthropic
+from openai import AsyncOpenAI
+from agents import (
+    ANALYSIS_RUBRIC,
+    ANTHROPIC_MODEL,
+    OPENAI_MODEL,
+    analysis_user_content,
+    cache_lookup,
+    cache_store,
+    compare_and_summarize,
+    extract_json_from_response,
+    get_http_client
+)
+import asyncio
+import logging
+import msgspec
+
+logger = logging.getLogger(__name__)
+
+_POLL_INITIAL_DELAY = 5.0
+_POLL_MAX_DELAY = 300.0
+# A completed batch is already paid for, so transient failures fetching it are retried rather than fatal
+_RETRY_ATTEMPTS = 5
+_RETRY_INITIAL_DELAY = 1.0
+_ANTHROPIC_MAX_TOKENS = 4096
+_COMPARISON_CONCURRENCY = 8
+# Cache lookups embed each article, so they are throttled to stay under the embeddings rate limit
+_CACHE_CONCURRENCY = 8
+
+# (article, topic) pairs keyed by the custom_id sent to the batch APIs
+Items = Dict[str, Tuple[str, str]]
+
+@lru_cache(maxsize=None)
+def get_openai_client() -> AsyncOpenAI:
+    return AsyncOpenAI(http_client=get_http_client())
+
+@lru_cache(maxsize=None)
+def get_anthropic_client() -> AsyncAnthropic:
+    return AsyncAnthropic(http_client=get_http_client())
+
+async def retry(call: Callable[[], Awaitable]):
+    """Await call(), retrying failures with exponential backoff and re-raising the last one."""
+    delay = _RETRY_INITIAL_DELAY
+    for attempt in range(_RETRY_ATTEMPTS):
+        try:
+            return await call()
+        except Exception:
+            if attempt == _RETRY_ATTEMPTS - 1:
+                raise
+            logger.warning("Batch API request failed; retrying in %.0fs", delay, exc_info=True)
+            await asyncio.sleep(delay)
+            delay *= 2
+
+async def poll(retrieve: Callable[[], Awaitable], is_done: Callable[[object], bool]):
+    """Call retrieve until is_done accepts its result, backing off exponentially between calls."""
+    delay = _POLL_INITIAL_DELAY
+    while True:
+        batch = await retry(retrieve)
+        if is_done(batch):
+            return batch
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, _POLL_MAX_DELAY)
+
+async def openai_batch_analyses(items: Items) -> Dict[str, Dict]:
+    client = get_openai_client()
+    lines = [
+        msgspec.json.encode({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": OPENAI_MODEL,
+                "temperature": 0,
+                "messages": [
+                    {"role": "system", "content": ANALYSIS_RUBRIC},
+                    {"role": "user", "content": analysis_user_content(article, topic)}
+                ]
+            }
+        })
+        for custom_id, (article, topic) in items.items()
+    ]
+    input_file = await client.files.create(file=("analyses.jsonl", b"\n".join(lines)), purpose="batch")
+    batch = await client.batches.create(
+        input_file_id=input_file.id, endpoint="/v1/chat/completions", completion_window="24h"
+    )
+    batch_id = batch.id
+    batch = await poll(
+        lambda: client.batches.retrieve(batch_id),
+        lambda b: b.status in ("completed", "failed", "expired", "cancelled")
+    )
+
+    results = {}
+    # Expired or cancelled batches still report whatever requests did finish
+    if batch.output_file_id:
+        output = await retry(lambda: client.files.content(batch.output_file_id))
+        for line in output.text.splitlines():
+            try:
+                entry = msgspec.json.decode(line)
+                results[entry["custom_id"]] = openai_entry_result(entry)
+            except (msgspec.DecodeError, AttributeError, IndexError, KeyError, TypeError):
+                # Entries missing from results are reported per article by batch_analyses
+                logger.warning("Skipping unreadable OpenAI batch output line: %.200s", line)
+    return results
+
+def openai_entry_result(entry: Dict) -> Dict:
+    """Parsed analysis from one line of an OpenAI batch output file, or an error dict."""
+    response = entry.get("response") or {}
+    if response.get("status_code") != 200:
+        return {"error": f"{OPENAI_MODEL} request failed: {entry.get('error') or response.get('status_code')}"}
+    message = response["body"]["choices"][0]["message"]
+    content = message.get("content")
+    # content is null when the model refuses
+    if not isinstance(content, str):
+        return {"error": "Failed to parse response", "raw_response": message.get("refusal")}
+    return extract_json_from_response(content)
+
+async def anthropic_batch_analyses(items: Items) -> Dict[str, Dict]:
+    client = get_anthropic_client()
+    batch = await client.messages.batches.create(requests=[
+        {
+            "custom_id": custom_id,
+            "params": {
+                "model": ANTHROPIC_MODEL,
+                "max_tokens": _ANTHROPIC_MAX_TOKENS,
+                "temperature": 0,
+                "system": [{"type": "text", "text": ANALYSIS_RUBRIC, "cache_control": {"type": "ephemeral"}}],
+                "messages": [{"role": "user", "content": analysis_user_content(article, topic)}]
+            }
+        }
+        for custom_id, (article, topic) in items.items()
+    ])
+    batch_id = batch.id
+    await poll(lambda: client.messages.batches.retrieve(batch_id), lambda b: b.processing_status == "ended")
+
+    results = {}
+    try:
+        async for entry in await retry(lambda: client.messages.batches.results(batch_id)):
+            if entry.result.type == "succeeded":
+                text = "".join(block.text for block in entry.result.message.content if block.type == "text")
+                results[entry.custom_id] = extract_json_from_response(text)
+            else:
+                results[entry.custom_id] = {"error": f"{ANTHROPIC_MODEL} request {entry.result.type}"}
+    except Exception:
+        # Keep the results already read; the rest are reported per article by batch_analyses
+        logger.warning("Failed to read all Anthropic batch results", exc_info=True)
+    return results
+
+async def cached_analyses(items: Items) -> Tuple[Dict[str, Dict], Dict[str, Dict]]:
+    """OpenAI and Anthropic analyses the semantic cache already has, keyed by custom_id.
+
+    Both models are looked up together per article so they share its single embedding call.
+    """
+    semaphore = asyncio.Semaphore(_CACHE_CONCURRENCY)
+
+    async def lookup(article: str, topic: str) -> Tuple[Dict, Dict]:
+        async with semaphore:
+            return await cache_lookup(OPENAI_MODEL, article, topic), await cache_lookup(ANTHROPIC_MODEL, article, topic)
+
+    hits = await asyncio.gather(*(lookup(article, topic) for article, topic in items.values()))
+    openai_hits = {custom_id: hit[0] for custom_id, hit in zip(items, hits) if hit[0] is not None}
+    anthropic_hits = {custom_id: hit[1] for custom_id, hit in zip(items, hits) if hit[1] is not None}
+    return openai_hits, anthropic_hits
+
+async def batch_analyses(
+    model_name: str, submit: Callable[[Items], Awaitable[Dict[str, Dict]]], items: Items, cached: Dict[str, Dict]
+) -> Dict[str, Dict]:
+    """Submit the items the cache couldn't answer as one provider batch.
+
+    Never raises for a failed batch: its articles get error dicts instead, so one provider's
+    failure doesn't discard the other provider's batch.
+    """
+    results = dict(cached)
+    pending = {custom_id: item for custom_id, item in items.items() if custom_id not in results}
+    if not pending:
+        return results
+
+    try:
+        submitted = await submit(pending)
+    except Exception as e:
+        return {**results, **{custom_id: {"error": f"{model_name} batch failed: {e}"} for custom_id in pending}}
+
+    for custom_id in pending:
+        results[custom_id] = submitted.get(custom_id, {"error": f"No {model_name} batch result for this article"})
+    return results
+
+async def store_analyses(items: Items, openai_new: Dict[str, Dict], anthropic_new: Dict[str, Dict]) -> None:
+    """Cache the analyses the batches returned, storing both models per article so they share its embedding."""
+    semaphore = asyncio.Semaphore(_CACHE_CONCURRENCY)
+
+    async def store(custom_id: str) -> None:
+        article, topic = items[custom_id]
+        async with semaphore:
+            for model_name, results in ((OPENAI_MODEL, openai_new), (ANTHROPIC_MODEL, anthropic_new)):
+                result = results.get(custom_id)
+                if result is not None and "error" not in result:
+                    await cache_store(model_name, article, topic, result)
+
+    await asyncio.gather(*(store(custom_id) for custom_id in items if custom_id in openai_new or custom_id in anthropic_new))
+
+async def analyze_batch(articles: List[Tuple[str, str]]) -> List[Dict]:
+    """Analyze many (article, topic) pairs through the OpenAI Batch and Anthropic Message Batches APIs.
+
+    Batches are billed at about half the interactive price but can take up to 24 hours to
+    complete, so this is meant for bulk jobs rather than interactive use.
+    """
+    items = {f"article-{i}": item for i, item in enumerate(articles)}
+    openai_cached, anthropic_cached = await cached_analyses(items)
+    openai_results, anthropic_results = await asyncio.gather(
+        batch_analyses(OPENAI_MODEL, openai_batch_analyses, items, openai_cached),
+        batch_analyses(ANTHROPIC_MODEL, anthropic_batch_analyses, items, anthropic_cached)
+    )
+    await store_analyses(
+        items,
+        {custom_id: result for custom_id, result in openai_results.items() if custom_id not in openai_cached},
+        {custom_id: result for custom_id, result in anthropic_results.items() if custom_id not in anthropic_cached}
+    )
+
+    semaphore = asyncio.Semaphore(_COMPARISON_CONCURRENCY)
+
+    async def compare(custom_id: str) -> Dict:
+        article, topic = items[custom_id]
+        async with semaphore:
+            final_comparison = await compare_and_summarize(
+                openai_results[custom_id], anthropic_results[custom_id], article, topic
+            )
+        return {
+            "openai_analysis": openai_results[custom_id],
+            "anthropic_analysis": anthropic_results[custom_id],
+            "final_comparison": final_comparison
+        }
+
+    return await asyncio.gather(*(compare(custom_id) for custom_id in items))
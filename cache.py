@@ -0,0 +1,177 @@
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+from langchain_openai import OpenAIEmbeddings
+import asyncio
+import faiss
+import hashlib
+import logging
+import numpy as np
+import os
+
+# Rows kept in an exact float32 index before switching to a trained int8 IVF index
+_TRAIN_SIZE = 10_000
+_NLIST = 100
+_NPROBE = 8
+# Distinct (topic, article) pairs kept; the least recently used are evicted past this
+_MAX_ENTRIES = 20_000
+# Embeddings kept around so a lookup and the put that follows it only embed the article once
+_RECENT_EMBEDDINGS = 1024
+
+logger = logging.getLogger(__name__)
+
+faiss.omp_set_num_threads(os.cpu_count())
+
+class SemanticCache:
+    """Cache of parsed LLM responses keyed on the (article, topic) pair.
+
+    Exact repeats are served from a hash lookup; near-duplicate articles with the
+    same topic are served from a cosine-similarity search over article embeddings.
+    """
+
+    def __init__(
+        self,
+        embeddings: OpenAIEmbeddings = None,
+        threshold: float = 0.97,
+        k: int = 4,
+        train_size: int = _TRAIN_SIZE,
+        max_entries: int = _MAX_ENTRIES
+    ):
+        self._embeddings = embeddings or OpenAIEmbeddings(model="text-embedding-3-small")
+        self._threshold = threshold
+        self._k = k
+        self._train_size = train_size
+        self._max_entries = max_entries
+        self._index: Optional[faiss.Index] = None
+        self._quantized = False
+        self._quantize_task: Optional[asyncio.Task] = None
+        self._next_id = 0
+        # Index id -> (text key, topic), and text key -> index id
+        self._rows: Dict[int, Tuple[str, str]] = {}
+        self._ids: Dict[str, int] = {}
+        # In-flight or finished embeddings, so concurrent lookups for one article share a single call
+        self._vectors: "OrderedDict[str, asyncio.Future]" = OrderedDict()
+        # Least recently used first
+        self._results: "OrderedDict[str, Dict[str, Dict]]" = OrderedDict()
+
+    @staticmethod
+    def _text_key(article: str, topic: str = None) -> str:
+        return hashlib.sha256(f"{topic or ''}\x00{article}".encode()).hexdigest()
+
+    async def _embed_article(self, article: str) -> np.ndarray:
+        vector = np.asarray([await self._embeddings.aembed_query(article)], dtype="float32")
+        faiss.normalize_L2(vector)
+        return vector
+
+    async def _embed(self, text_key: str, article: str) -> np.ndarray:
+        future = self._vectors.get(text_key)
+        if future is not None:
+            self._vectors.move_to_end(text_key)
+        else:
+            future = asyncio.ensure_future(self._embed_article(article))
+            self._vectors[text_key] = future
+            if len(self._vectors) > _RECENT_EMBEDDINGS:
+                self._vectors.popitem(last=False)
+        try:
+            # Shielded so one caller being cancelled doesn't fail the others sharing the call
+            return await asyncio.shield(future)
+        except Exception:
+            # Don't memoize failures; the next lookup retries the embedding
+            if self._vectors.get(text_key) is future:
+                del self._vectors[text_key]
+            raise
+
+    def _add(self, text_key: str, topic: str, vector: np.ndarray) -> None:
+        if self._index is None:
+            self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+        row_id = self._next_id
+        self._next_id += 1
+        self._index.add_with_ids(vector, np.asarray([row_id], dtype="int64"))
+        self._rows[row_id] = (text_key, topic)
+        self._ids[text_key] = row_id
+        self._results[text_key] = {}
+        if not self._quantized and self._quantize_task is None and self._index.ntotal >= self._train_size:
+            self._quantize_task = asyncio.ensure_future(self._quantize())
+
+    def _evict(self) -> None:
+        while len(self._results) > self._max_entries:
+            text_key, _ = self._results.popitem(last=False)
+            row_id = self._ids.pop(text_key)
+            del self._rows[row_id]
+            self._index.remove_ids(np.asarray([row_id], dtype="int64"))
+
+    @staticmethod
+    def _build_quantized(vectors: np.ndarray, ids: np.ndarray) -> faiss.Index:
+        # index_factory gives an IndexIVFScalarQuantizer that owns its coarse quantizer
+        index = faiss.index_factory(vectors.shape[1], f"IVF{_NLIST},SQ8", faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.add_with_ids(vectors, ids)
+        faiss.extract_index_ivf(index).nprobe = _NPROBE
+        return index
+
+    async def _quantize(self) -> None:
+        """Replace the exact float32 index with an int8 IVF index trained on everything stored so far.
+
+        Training takes on the order of a second, so it runs in a worker thread on a snapshot while
+        the flat index keeps serving; rows added or evicted meanwhile are reconciled before the swap.
+        """
+        flat = self._index
+        vectors = flat.index.reconstruct_n(0, flat.ntotal)
+        ids = faiss.vector_to_array(flat.id_map)
+        try:
+            index = await asyncio.to_thread(self._build_quantized, vectors, ids)
+        except Exception:
+            # Keep serving from the exact index rather than retrying on every put
+            logger.warning("Failed to build the quantized cache index; keeping the float32 index", exc_info=True)
+            self._quantized = True
+            return
+
+        current = faiss.vector_to_array(flat.id_map)
+        added = current[~np.isin(current, ids)]
+        removed = ids[~np.isin(ids, current)]
+        if len(added):
+            index.add_with_ids(np.vstack([flat.reconstruct(int(row_id)) for row_id in added]), added)
+        if len(removed):
+            index.remove_ids(removed)
+        self._index = index
+        self._quantized = True
+
+    async def get(self, model_name: str, article: str, topic: str = None) -> Optional[Dict]:
+        """Return the cached result for model_name on an identical or near-identical article, if any."""
+        text_key = self._text_key(article, topic)
+        entry = self._results.get(text_key)
+        if entry is not None and model_name in entry:
+            self._results.move_to_end(text_key)
+            return entry[model_name]
+        if self._index is None or self._index.ntotal == 0:
+            return None
+
+        vector = await self._embed(text_key, article)
+        scores, ids = self._index.search(vector, min(self._k, self._index.ntotal))
+        for score, row_id in zip(scores[0], ids[0]):
+            if row_id < 0 or score < self._threshold:
+                break
+            row = self._rows.get(int(row_id))
+            if row is None:
+                continue
+            hit_key, hit_topic = row
+            if hit_topic == topic and model_name in self._results[hit_key]:
+                self._results.move_to_end(hit_key)
+                return self._results[hit_key][model_name]
+        return None
+
+    async def put(self, model_name: str, article: str, topic: str, result: Dict) -> None:
+        text_key = self._text_key(article, topic)
+        if text_key not in self._results:
+            vector = await self._embed(text_key, article)
+            # The other analysis for this article may have registered it while we awaited
+            if text_key not in self._results:
+                self._add(text_key, topic, vector)
+        self._results[text_key][model_name] = result
+        self._results.move_to_end(text_key)
+        self._evict()
+
+@lru_cache(maxsize=None)
+def get_cache() -> SemanticCache:
+    """Process-wide cache, created on first use so importing doesn't require an API key."""
+    return SemanticCache()
@@ -1,10 +1,18 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from typing import Dict
-from agents import create_analysis_graph, AgentState
+from typing import Dict, List, Optional, Tuple
+from agents import analyze_with_anthropic, analyze_with_openai, compare_and_summarize, get_anthropic_llm, get_merge_llm, get_openai_llm, use_http_client
+from batch import analyze_batch, get_anthropic_client, get_openai_client
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+import asyncio
+import hashlib
+import httpx
 import os
-import json
+import orjson
+import re
 
 # Load environment variables
 load_dotenv()
@@ -13,10 +21,33 @@ load_dotenv()
 if not os.getenv("OPENAI_API_KEY") or not os.getenv("ANTHROPIC_API_KEY"):
     raise EnvironmentError("Missing required API keys. Please set OPENAI_API_KEY and ANTHROPIC_API_KEY in .env file")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One keep-alive HTTP/2 connection pool for the OpenAI chat calls and the batch API clients;
+    # ChatAnthropic and the cache's embeddings client keep their own pools
+    limits = httpx.Limits(max_connections=50, max_keepalive_connections=50)
+    async with httpx.AsyncClient(http2=True, limits=limits) as http_client:
+        use_http_client(http_client)
+        # Build the shared LLM clients inside the server's event loop, before the first request
+        get_openai_llm()
+        get_anthropic_llm()
+        get_merge_llm()
+        try:
+            yield
+        finally:
+            # Running batch jobs use the client, so they can't outlive it
+            for job in BATCH_JOBS.values():
+                job.cancel()
+            use_http_client(None)
+            get_openai_client.cache_clear()
+            get_anthropic_client.cache_clear()
+
 app = FastAPI(
     title="Article Analysis Agent",
-    description="API for analyzing articles using LangGraph with OpenAI and Anthropic models",
-    version="1.0.0"
+    description="API for analyzing articles with OpenAI and Anthropic models",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 class ArticleRequest(BaseModel):
@@ -28,37 +59,121 @@ class AnalysisResponse(BaseModel):
     anthropic_analysis: Dict
     final_comparison: Dict
 
-def analyze_text(text: str, topic: str = None) -> Dict:
-    """Analyze text directly without going through the API"""
-    if len(text.strip()) < 50:
+class BatchJobResponse(BaseModel):
+    job_id: str
+    status: str  # "running", "completed" or "failed"
+    results: Optional[List[AnalysisResponse]] = None
+    error: Optional[str] = None
+
+_NON_SPACE_RE = re.compile(r"\S")
+
+def stripped_length(text: str) -> int:
+    """Length of text.strip() without copying the text."""
+    first = _NON_SPACE_RE.search(text)
+    if first is None:
+        return 0
+    end = len(text)
+    while text[end - 1].isspace():
+        end -= 1
+    return end - first.start()
+
+# Analyses currently running, keyed on (topic, text), so identical concurrent requests share one run
+INFLIGHT: Dict[str, asyncio.Future] = {}
+
+# Batch jobs keyed on a hash of their payload; finished ones are kept for their results, oldest dropped first
+BATCH_JOBS: "OrderedDict[str, asyncio.Future]" = OrderedDict()
+MAX_FINISHED_BATCH_JOBS = 100
+
+def validate_article(text: str) -> None:
+    if stripped_length(text) < 50:
         raise ValueError("Article text is too short. Please provide at least 50 characters.")
+
+async def analyze_text(text: str, topic: str = None) -> Dict:
+    """Analyze text directly without going through the API"""
+    validate_article(text)
     
-    chain = create_analysis_graph()
-    initial_state = AgentState(
-        messages=[],
-        article=text,
-        topic=topic,
-        openai_analysis={},
-        anthropic_analysis={},
-        final_comparison={}
-    )
+    key = hashlib.blake2b(f"{topic or ''}\x00{text}".encode(), digest_size=16).hexdigest()
+    future = INFLIGHT.get(key)
+    if future is None:
+        future = asyncio.ensure_future(run_pipeline(text, topic))
+        INFLIGHT[key] = future
+        future.add_done_callback(lambda _: INFLIGHT.pop(key, None))
     
-    final_state = chain.invoke(initial_state)
+    # Shielded so a caller that disconnects doesn't cancel the run for the others waiting on it
+    return await asyncio.shield(future)
+
+async def run_pipeline(text: str, topic: str = None) -> Dict:
+    """Run both analyses concurrently, then compare them."""
+    openai_analysis, anthropic_analysis = await asyncio.gather(
+        analyze_with_openai(text, topic),
+        analyze_with_anthropic(text, topic)
+    )
+    final_comparison = await compare_and_summarize(openai_analysis, anthropic_analysis, text, topic)
     return {
-        "openai_analysis": final_state["openai_analysis"],
-        "anthropic_analysis": final_state["anthropic_analysis"],
-        "final_comparison": final_state["final_comparison"]
+        "openai_analysis": openai_analysis,
+        "anthropic_analysis": anthropic_analysis,
+        "final_comparison": final_comparison
     }
 
 @app.post("/analyze", response_model=AnalysisResponse)
 async def analyze_article(request: ArticleRequest):
     try:
-        return analyze_text(request.text, request.topic)
+        return await analyze_text(request.text, request.topic)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
+def start_batch_job(articles: List[Tuple[str, str]]) -> str:
+    """Start analyze_batch in the background and return its job id.
+
+    The id is a hash of the payload, so a client that retries the same POST gets the running
+    (or finished) job back instead of submitting and paying for the provider batches again.
+    """
+    job_id = hashlib.blake2b(orjson.dumps([[text, topic or ""] for text, topic in articles]), digest_size=16).hexdigest()
+    job = BATCH_JOBS.get(job_id)
+    if job is None or (job.done() and (job.cancelled() or job.exception() is not None)):
+        BATCH_JOBS[job_id] = asyncio.ensure_future(analyze_batch(articles))
+    BATCH_JOBS.move_to_end(job_id)
+
+    finished = [key for key in BATCH_JOBS if BATCH_JOBS[key].done()]
+    for key in finished[:max(len(finished) - MAX_FINISHED_BATCH_JOBS, 0)]:
+        del BATCH_JOBS[key]
+    return job_id
+
+def batch_job_status(job_id: str, job: asyncio.Future) -> BatchJobResponse:
+    if not job.done():
+        return BatchJobResponse(job_id=job_id, status="running")
+    if job.cancelled():
+        return BatchJobResponse(job_id=job_id, status="failed", error="Batch analysis was cancelled")
+    if job.exception() is not None:
+        return BatchJobResponse(job_id=job_id, status="failed", error=f"Batch analysis failed: {job.exception()}")
+    return BatchJobResponse(job_id=job_id, status="completed", results=job.result())
+
+@app.post("/analyze_batch", response_model=BatchJobResponse, status_code=202)
+async def analyze_articles(requests: List[ArticleRequest]):
+    """Start analyzing many articles through the providers' batch APIs; slower to finish but about half the cost.
+
+    Batches can take up to 24 hours, so this returns a job id to poll at GET /analyze_batch/{job_id}.
+    """
+    try:
+        for i, request in enumerate(requests):
+            try:
+                validate_article(request.text)
+            except ValueError as e:
+                raise ValueError(f"Article {i}: {e}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    job_id = start_batch_job([(request.text, request.topic) for request in requests])
+    return batch_job_status(job_id, BATCH_JOBS[job_id])
+
+@app.get("/analyze_batch/{job_id}", response_model=BatchJobResponse)
+async def get_batch_job(job_id: str):
+    job = BATCH_JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown batch job")
+    return batch_job_status(job_id, job)
+
 @app.get("/")
 async def root():
     return {
@@ -86,7 +201,7 @@ At a systemic level, a capitalist system will always convert tech into either ne
     topic = "technology productivity and time savings"
     
     try:
-        result = analyze_text(sample_text, topic)
-        print(json.dumps(result, indent=2))
+        result = asyncio.run(analyze_text(sample_text, topic))
+        print(orjson.dumps(result, option=orjson.OPT_INDENT_2).decode())
     except Exception as e:
         print(f"Error: {str(e)}") 
\ No newline at end of file
@@ -0,0 +1,58 @@
+import random
+import msgspec
+from agents import ObjectEndDetector
+
+# Strings that hide braces and quotes behind escapes, so a split inside one exercises the detector's state
+_TRICKY_STRINGS = ["{", "}", '"', "\\", '\\"}', "}}{{", "\\\\", "a\\\\\"b", "é中{€}", "\n\t"]
+
+def _random_value(rng: random.Random, depth: int = 0):
+    kind = rng.randrange(5 if depth < 3 else 3)
+    if kind == 0:
+        return "".join(rng.choice(_TRICKY_STRINGS) for _ in range(rng.randrange(4)))
+    if kind == 1:
+        return rng.randrange(-1000, 1000)
+    if kind == 2:
+        return rng.choice([True, False, None, 1.5])
+    if kind == 3:
+        return [_random_value(rng, depth + 1) for _ in range(rng.randrange(4))]
+    return _random_object(rng, depth + 1)
+
+def _random_object(rng: random.Random, depth: int = 0) -> dict:
+    return {
+        "".join(rng.choice(_TRICKY_STRINGS) for _ in range(rng.randrange(1, 3))) + str(i): _random_value(rng, depth)
+        for i in range(rng.randrange(4))
+    }
+
+def _split(rng: random.Random, text: str) -> list:
+    cuts = sorted(rng.sample(range(1, len(text)), min(rng.randrange(len(text)), 12))) if len(text) > 1 else []
+    return [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+
+def _feed(chunks: list) -> int:
+    """Offset in the joined chunks where the detector reports the object closed, or -1."""
+    detector = ObjectEndDetector()
+    consumed = 0
+    for chunk in chunks:
+        end = detector.feed(chunk)
+        if end >= 0:
+            return consumed + end
+        consumed += len(chunk)
+    return -1
+
+def test_object_end_detector_chunk_split_fuzz():
+    rng = random.Random(0)
+    for _ in range(2000):
+        obj = msgspec.json.encode(_random_object(rng)).decode()
+        leading = rng.choice(["", " ", "\n  "])
+        trailing = rng.choice(["", "\n", "\nHope this helps! {\"not\": \"json\"}", "}}}"])
+        text = leading + obj + trailing
+        assert _feed(_split(rng, text)) == len(leading) + len(obj), text
+
+def test_object_end_detector_ignores_fenced_responses():
+    rng = random.Random(1)
+    text = '```json\n{"a": "}"}\n```'
+    for _ in range(100):
+        assert _feed(_split(rng, text)) == -1
+
+def test_object_end_detector_escape_split_across_chunks():
+    # The backslash ends one chunk and the quote it escapes starts the next
+    assert _feed(['{"a": "x\\', '"}', '"}']) == len('{"a": "x\\"}"}')